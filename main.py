@@ -1,23 +1,236 @@
+import collections
+import hashlib
 import os
-import subprocess
+import stat
+import struct
+import tempfile
 import threading
-try:
-    import fcntl
-except ImportError:
-    fcntl = None
-from typing import Any, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image as PILImage
 
 from kivy.app import App
 from kivy.core.window import Window
+from kivy.graphics.texture import Texture
+from kivy.properties import NumericProperty, StringProperty
 from kivy.uix.boxlayout import BoxLayout
-from kivy.uix.image import Image
 from kivy.uix.label import Label
 from kivy.clock import Clock
 
+_thumb_pool: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+_THUMB_SIZE: int = 120
+_THUMB_MEM: "collections.OrderedDict[str, Tuple[bytes, int, int, int, int]]" = collections.OrderedDict()
+_THUMB_MEM_MAX: int = 512
+_thumb_mem_lock: threading.Lock = threading.Lock()
+
+def _thumb_key(file_path: str) -> str:
+    """
+    サムネイルキャッシュのキーを計算します。
+    パスと更新時刻とサムネイルサイズから導出するため、
+    元画像が更新されるとキャッシュは自動的に無効になります。
+
+    Args:
+        file_path: 画像ファイルのパス。
+
+    Returns:
+        16進数のキー文字列。
+    """
+    mtime: int = os.stat(file_path).st_mtime_ns
+    raw: bytes = f"{file_path}|{mtime}|{_THUMB_SIZE}".encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+def _thumb_dir() -> Path:
+    """ディスク上のサムネイルキャッシュディレクトリを返します（なければ作成）。"""
+    directory: Path = Path(App.get_running_app().user_data_dir) / "thumbs"
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+def _thumb_mem_put(key: str, entry: Tuple[bytes, int, int, int, int]) -> None:
+    """メモリキャッシュへ登録し、上限超過時はLRUエントリを追い出します。"""
+    with _thumb_mem_lock:
+        _THUMB_MEM[key] = entry
+        _THUMB_MEM.move_to_end(key)
+        while len(_THUMB_MEM) > _THUMB_MEM_MAX:
+            _THUMB_MEM.popitem(last=False)
+
+def _load_thumb(file_path: str) -> Tuple[bytes, int, int, int, int]:
+    """
+    サムネイル画像をバックグラウンドスレッドで取得します。
+    メモリキャッシュ → ディスクキャッシュ → 元画像のデコードの順に
+    探索する二段キャッシュです。デコード時はPILのdraftでlibjpegの
+    縮小デコードを有効にし、表示サイズ程度まで縮小します。
+    元画像の寸法も返すため、UIスレッド側でアスペクト比のために
+    画像を再デコードする必要はありません。
+
+    Args:
+        file_path: 画像ファイルのパス。
+
+    Returns:
+        (RGBAバイト列, サムネイル幅, サムネイル高さ, 元画像幅, 元画像高さ) のタプル。
+    """
+    key: str = _thumb_key(file_path)
+    with _thumb_mem_lock:
+        entry = _THUMB_MEM.get(key)
+        if entry is not None:
+            _THUMB_MEM.move_to_end(key)
+            return entry
+    disk_path: Path = _thumb_dir() / f"{key}.rgba"
+    try:
+        data: bytes = disk_path.read_bytes()
+        width, height, orig_w, orig_h = struct.unpack("<IIII", data[:16])
+        if len(data) == 16 + width * height * 4:
+            entry = (data[16:], width, height, orig_w, orig_h)
+            _thumb_mem_put(key, entry)
+            return entry
+    except (OSError, struct.error):
+        pass
+    with PILImage.open(file_path) as im:
+        orig_w, orig_h = im.size
+        im.draft("RGB", (_THUMB_SIZE * 2, _THUMB_SIZE * 2))
+        im.thumbnail((_THUMB_SIZE, _THUMB_SIZE), PILImage.Resampling.BILINEAR)
+        rgba = im.convert("RGBA")
+        entry = (rgba.tobytes(), rgba.width, rgba.height, orig_w, orig_h)
+    fd, tmp_path = tempfile.mkstemp(dir=disk_path.parent, suffix=".tmp")
+    try:
+        os.write(fd, struct.pack("<IIII", *entry[1:]))
+        os.write(fd, entry[0])
+        os.close(fd)
+        os.replace(tmp_path, disk_path)
+    except OSError:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+    _thumb_mem_put(key, entry)
+    return entry
+
+class _AtlasPage:
+    """
+    サムネイルを詰め込むアトラステクスチャの1ページ分。
+    単純なシェルフ方式で左下から右上へ領域を割り当てます。
+    GLリソースを扱うためUIスレッドからのみ使用してください。
+    """
+    SIZE: int = 2048
+    PAD: int = 2
+
+    def __init__(self) -> None:
+        self.texture: Texture = Texture.create(
+            size=(self.SIZE, self.SIZE), colorfmt="rgba", mipmap=True)
+        self.texture.min_filter = "linear_mipmap_linear"
+        self._x: int = 0
+        self._y: int = 0
+        self._shelf_height: int = 0
+
+    def allocate(self, width: int, height: int) -> Optional[Tuple[int, int]]:
+        """width×heightの空き領域を確保し、左下座標を返します（満杯ならNone）。"""
+        if self._x + width + self.PAD > self.SIZE:
+            self._y += self._shelf_height + self.PAD
+            self._x = 0
+            self._shelf_height = 0
+        if self._y + height + self.PAD > self.SIZE:
+            return None
+        pos: Tuple[int, int] = (self._x, self._y)
+        self._x += width + self.PAD
+        self._shelf_height = max(self._shelf_height, height)
+        return pos
+
+_atlas_pages: List[_AtlasPage] = []
+_atlas_regions: Dict[str, Texture] = {}
+
+def _atlas_blit(file_path: str, rgba: bytes, width: int, height: int) -> Texture:
+    """
+    サムネイルをアトラスページへblitし、対応する領域テクスチャを返します。
+    同一パスは同じ領域を再利用するため、RecycleViewの行が再利用されても
+    blitは1回だけです。ページが満杯になると新しいページを確保します。
+
+    Args:
+        file_path: 元画像のパス（領域キャッシュのキー）。
+        rgba: サムネイルのRGBAバイト列（上から下の行順）。
+        width: サムネイルの幅。
+        height: サムネイルの高さ。
+
+    Returns:
+        アトラス内の領域を指すテクスチャ。
+    """
+    region = _atlas_regions.get(file_path)
+    if region is not None:
+        return region
+    limit: int = _AtlasPage.SIZE - _AtlasPage.PAD
+    if width > limit or height > limit:
+        texture: Texture = Texture.create(
+            size=(width, height), colorfmt="rgba", mipmap=True)
+        texture.blit_buffer(rgba, colorfmt="rgba", bufferfmt="ubyte")
+        texture.min_filter = "linear_mipmap_linear"
+        texture.flip_vertical()
+        _atlas_regions[file_path] = texture
+        return texture
+    if not _atlas_pages:
+        _atlas_pages.append(_AtlasPage())
+    pos = _atlas_pages[-1].allocate(width, height)
+    if pos is None:
+        _atlas_pages.append(_AtlasPage())
+        pos = _atlas_pages[-1].allocate(width, height)
+    page: _AtlasPage = _atlas_pages[-1]
+    page.texture.blit_buffer(
+        rgba, size=(width, height), pos=pos, colorfmt="rgba", bufferfmt="ubyte")
+    region = page.texture.get_region(pos[0], pos[1], width, height)
+    region.flip_vertical()
+    _atlas_regions[file_path] = region
+    return region
+
+def _atlas_clear() -> None:
+    """アトラスの全ページと領域キャッシュを破棄します。"""
+    _atlas_regions.clear()
+    _atlas_pages.clear()
+
+def _sync_text_size(instance: Any, width: float) -> None:
+    """ラベルの折り返し幅をウィジェット幅に追従させる共有コールバック。"""
+    instance.text_size = (width, None)
+
 class Mode:
     LEARNING: str = "learning"
     CLASSIFICATION: str = "classification"
 
+class ThumbRow(BoxLayout):
+    """
+    分類モードの1行分のビュー（サムネイル + パス表示）。
+    RecycleViewのviewclassとして使われ、画面内の行だけが実体化され、
+    スクロールに応じて再利用されます。レイアウトはmain.kvに定義されています。
+    """
+    path = StringProperty("")
+    thumb_width = NumericProperty(120)
+
+    def on_path(self, instance: Any, value: str) -> None:
+        self.ids.thumb.texture = None
+        self.thumb_width = 120
+        if not value:
+            return
+
+        def on_thumb_done(future: Any, file_path: str = value) -> None:
+            try:
+                entry = future.result()
+            except Exception:
+                return
+            Clock.schedule_once(
+                lambda dt: self._apply_thumb(file_path, *entry), 0)
+
+        _thumb_pool.submit(_load_thumb, value).add_done_callback(on_thumb_done)
+
+    def _apply_thumb(self, file_path: str, rgba: bytes, width: int,
+                     height: int, orig_w: int, orig_h: int) -> None:
+        if file_path != self.path:
+            return
+        self.ids.thumb.texture = _atlas_blit(file_path, rgba, width, height)
+        self.thumb_width = 120 * (orig_w / orig_h) if orig_h else 120
+
 class MainWidget(BoxLayout):
     """
     メインウィジェットクラス。
@@ -25,6 +238,11 @@ class MainWidget(BoxLayout):
     ドラッグ＆ドロップされたファイルやフォルダの内容を表示するスクロール可能な領域を含みます。
     UIの設定はmain.kvに定義されています。
     """
+    __slots__ = ("mode", "scheduled_events")
+
+    _io_pool: ThreadPoolExecutor = ThreadPoolExecutor(
+        max_workers=min(8, (os.cpu_count() or 4)))
+
     def __init__(self, **kwargs: Any) -> None:
         """
         初期化処理。
@@ -42,29 +260,14 @@ class MainWidget(BoxLayout):
             self.mode = Mode.LEARNING
         else:
             self.mode = Mode.CLASSIFICATION
-    
+        is_learning: bool = self.mode == Mode.LEARNING
+        self.ids.rv.size_hint_y = None if is_learning else 1
+        self.ids.rv.height = 0
+        self.ids.scroll_view.size_hint_y = 1 if is_learning else None
+        self.ids.scroll_view.height = 0
+
     def add_classification_item(self, file_path: str) -> None:
-        item_box: BoxLayout = BoxLayout(
-            orientation="horizontal", 
-            size_hint_y=None, 
-            height="130dp", 
-            padding=5, 
-            spacing=5
-        )
-        img: Image = Image(source=file_path, size_hint=(None, None), size=(0, 120))
-        try:
-            img.texture_update()
-        except Exception:
-            img.texture = None
-        if img.texture and img.texture.height != 0:
-            aspect_ratio: float = img.texture.width / img.texture.height
-            img.width = 120 * aspect_ratio
-        else:
-            img.width = 120
-        path_label: Label = Label(text=file_path, size_hint_x=1)
-        item_box.add_widget(img)
-        item_box.add_widget(path_label)
-        self.ids.content_box.add_widget(item_box)
+        self.ids.rv.data.append({"path": file_path})
     
     def add_learning_item(self, folder_path: str) -> None:
         result_label: Label = Label(
@@ -74,93 +277,135 @@ class MainWidget(BoxLayout):
             halign="left",
             valign="top"
         )
-        result_label.bind(width=lambda instance, width: setattr(instance, 'text_size', (width, None)))
+        result_label.bind(width=_sync_text_size)
         self.ids.content_box.add_widget(result_label)
         
-        def run_ls_command():
+        def format_entry(name: str, st: os.stat_result) -> str:
+            timestamp = time.strftime("%b %d %H:%M", time.localtime(st.st_mtime))
+            return f"{stat.filemode(st.st_mode)} {st.st_size:>10} {timestamp} {name}"
+
+        pending = collections.deque()
+
+        def apply_update(dt):
+            if not pending:
+                return
+            lines = []
+            while pending:
+                lines.append(pending.popleft())
+            result_label.text += "\n" + "\n".join(lines)
+
+        apply_trigger = Clock.create_trigger(apply_update, 0)
+
+        def run_listing():
             try:
-                cmd: List[str] = (["ls", "-la", folder_path] 
-                                  if os.name != "nt" 
-                                  else ["cmd", "/c", "dir", folder_path])
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    bufsize=1,
-                    universal_newlines=True
-                )
-                if fcntl:
-                    flags: int = fcntl.fcntl(process.stdout, fcntl.F_GETFL)
-                    fcntl.fcntl(process.stdout, fcntl.F_SETFL, flags | os.O_NONBLOCK)
-                output_lines = []
-                def update_label(dt):
-                    try:
-                        while True:
-                            line = process.stdout.readline()
-                            if not line:
-                                break
-                            output_lines.append(line.strip())
-                    except IOError:
-                        pass
-                    if process.poll() is None:
-                        result_label.text = f"[{folder_path}]\n実行中...\n" + "\n".join(output_lines)
-                        return True
-                    else:
-                        stdout, stderr = process.communicate()
-                        if stderr:
-                            result_label.text = f"[{folder_path}]\nエラー: {stderr}"
-                        else:
-                            for line in stdout.splitlines():
-                                if line.strip() and line.strip() not in output_lines:
-                                    output_lines.append(line.strip())
-                            result_label.text = f"[{folder_path}]\n" + "\n".join(output_lines)
-                        return False
-                event = Clock.schedule_interval(update_label, 0.1)
-                self.scheduled_events.append(event)
+                last_push = 0.0
+                batch = []
+
+                def push_append():
+                    if batch:
+                        pending.extend(batch)
+                        batch.clear()
+                    apply_trigger()
+
+                top_stat = os.stat(folder_path)
+                if stat.S_ISDIR(top_stat.st_mode):
+                    with os.scandir(folder_path) as it:
+                        for entry in it:
+                            try:
+                                st = entry.stat(follow_symlinks=False)
+                                batch.append(format_entry(entry.name, st))
+                            except OSError as err:
+                                batch.append(f"{entry.name} (エラー: {err})")
+                            now = time.monotonic()
+                            if now - last_push >= 0.05:
+                                last_push = now
+                                push_append()
+                else:
+                    batch.append(format_entry(
+                        os.path.basename(folder_path), top_stat))
+                push_append()
+
+                def finish(dt):
+                    result_label.text = result_label.text.replace(
+                        "\n実行中...", "", 1)
+                Clock.schedule_once(finish, 0)
             except Exception as err:
                 def show_error(dt):
                     result_label.text = f"[{folder_path}]\nエラー: {err}"
                 Clock.schedule_once(show_error, 0)
-        
-        threading.Thread(target=run_ls_command, daemon=True).start()
+
+        self.scheduled_events.append(self._io_pool.submit(run_listing))
     
     def clear_items(self) -> None:
         for event in self.scheduled_events:
-            Clock.unschedule(event)
+            event.cancel()
         self.scheduled_events.clear()
+        self.ids.rv.data = []
         self.ids.content_box.clear_widgets()
+        _atlas_clear()
+
+    def handle_drop(self, paths: List[str]) -> None:
+        """
+        ドロップされたパス群を現在のモードに応じてまとめて処理します。
+
+        Args:
+            paths: ドロップされたファイル・フォルダのパスのリスト。
+        """
+        is_learning: bool = self.mode == Mode.LEARNING
+        if is_learning:
+            self.clear_items()
+        paths = sorted(
+            paths, key=lambda p: (os.path.dirname(p), os.path.basename(p)))
+        new_items: List[dict] = []
+        add_item = new_items.append
+        add_learning = self.add_learning_item
+        for fp in paths:
+            try:
+                is_dir: bool = stat.S_ISDIR(os.stat(fp).st_mode)
+            except OSError:
+                continue
+            if is_dir:
+                if is_learning:
+                    add_learning(fp)
+                else:
+                    with os.scandir(fp) as it:
+                        file_paths: List[str] = sorted(
+                            entry.path for entry in it
+                            if entry.is_file(follow_symlinks=False))
+                    new_items.extend({"path": p} for p in file_paths)
+            else:
+                if is_learning:
+                    add_learning(fp)
+                else:
+                    add_item({"path": fp})
+        if new_items:
+            self.ids.rv.data.extend(new_items)
 
 class MainApp(App):
     def build(self) -> MainWidget:
         self.title: str = "Kivy Cline Test"
-        main_widget: MainWidget = MainWidget()
-        Clock.schedule_once(lambda dt: Window.bind(on_dropfile=main_widget_on_drop), 0)
-        return main_widget
-
-def main_widget_on_drop(window: Any, file_path_bytes: bytes) -> None:
-    file_path_str: str = file_path_bytes.decode("utf-8")
-    app: MainApp = App.get_running_app()
-    main_widget: MainWidget = app.root
-    if main_widget.mode == Mode.LEARNING:
-        main_widget.clear_items()
-    paths = [p for p in file_path_str.splitlines() if p]
-    if not paths:
-        paths = [file_path_str]
-    for fp in paths:
-        if os.path.isdir(fp):
-            if main_widget.mode == Mode.LEARNING:
-                main_widget.add_learning_item(fp)
-            else:
-                for entry in os.listdir(fp):
-                    full_path: str = os.path.join(fp, entry)
-                    if os.path.isfile(full_path):
-                        main_widget.add_classification_item(full_path)
-        else:
-            if main_widget.mode == Mode.CLASSIFICATION:
-                main_widget.add_classification_item(fp)
-            elif main_widget.mode == Mode.LEARNING:
-                main_widget.add_learning_item(fp)
+        self._main_widget: MainWidget = MainWidget()
+        self._drop_queue: List[str] = []
+        self._flush_trigger = Clock.create_trigger(self._flush_drops, 0)
+        Clock.schedule_once(
+            lambda dt: Window.bind(on_drop_file=self._on_drop_file), 0)
+        return self._main_widget
+
+    def _on_drop_file(self, window: Any, file_path_bytes: bytes,
+                      *args: Any) -> None:
+        """ドロップイベントをキューへ積むだけの軽量ハンドラ。"""
+        self._drop_queue.append(file_path_bytes.decode("utf-8"))
+        self._flush_trigger()
+
+    def _flush_drops(self, dt: float) -> None:
+        """同一フレームに届いたドロップをまとめて1回で処理します。"""
+        raw_paths, self._drop_queue = self._drop_queue, []
+        paths: List[str] = []
+        for raw in raw_paths:
+            split = [p for p in raw.splitlines() if p]
+            paths.extend(split if split else [raw])
+        if paths:
+            self._main_widget.handle_drop(paths)
 
 if __name__ == "__main__":
     MainApp().run()